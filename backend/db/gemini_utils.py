@@ -1,11 +1,17 @@
 import os
+import re
 import google.generativeai as genai
 from dotenv import load_dotenv
 import faiss
-from sentence_transformers import SentenceTransformer
+from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
 import numpy as np
-import json
+import orjson
 import logging
+import threading
+import time
+import queue
+from concurrent.futures import Future
+from collections import deque
 
 logging.basicConfig(level=logging.INFO)
 
@@ -14,13 +20,33 @@ genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
 # --- RAG Components Configuration ---
 EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2' # A good balance of performance and size
+EMBEDDING_MODEL_DIR = 'embedding_model_onnx' # Local copy of the model with its int8-quantized ONNX export
+ONNX_QUANTIZATION_CONFIG = 'avx512_vnni' # Dynamic int8 quantization targeting VNNI int8 GEMM kernels
+QUANTIZED_ONNX_FILE = f'onnx/model_qint8_{ONNX_QUANTIZATION_CONFIG}.onnx'
 FAISS_INDEX_PATH = 'faiss_index.bin'
 CONTEXT_DATA_PATH = 'context_data.json'
 
+# --- Semantic SQL Cache Configuration ---
+SQL_CACHE_SIMILARITY_THRESHOLD = 0.95 # Cosine similarity above which a past question counts as the same
+SQL_CACHE_MAX_ENTRIES = 1024
+SQL_CACHE_CANDIDATES = 4 # Nearest past questions checked for matching literals
+
 embedding_model = None
 faiss_index = None
 context_texts = []
 
+def load_embedding_model():
+    """
+    Loads the embedding model through the ONNX Runtime backend with int8-quantized weights.
+    Exports and quantizes the model once into EMBEDDING_MODEL_DIR if it isn't cached yet.
+    """
+    if not os.path.exists(os.path.join(EMBEDDING_MODEL_DIR, QUANTIZED_ONNX_FILE)):
+        logging.info(f"Exporting {EMBEDDING_MODEL_NAME} to int8-quantized ONNX in {EMBEDDING_MODEL_DIR}")
+        onnx_model = SentenceTransformer(EMBEDDING_MODEL_NAME, backend="onnx")
+        onnx_model.save(EMBEDDING_MODEL_DIR)
+        export_dynamic_quantized_onnx_model(onnx_model, ONNX_QUANTIZATION_CONFIG, EMBEDDING_MODEL_DIR)
+    return SentenceTransformer(EMBEDDING_MODEL_DIR, backend="onnx", model_kwargs={"file_name": QUANTIZED_ONNX_FILE})
+
 def initialize_rag_components():
     """
     Initializes the SentenceTransformer model and FAISS index.
@@ -32,7 +58,7 @@ def initialize_rag_components():
     if embedding_model is None:
         logging.info(f"Loading embedding model: {EMBEDDING_MODEL_NAME}")
         try:
-            embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+            embedding_model = load_embedding_model()
         except Exception as e:
             logging.error(f"Failed to load SentenceTransformer model: {e}")
             logging.error("Please ensure you have an active internet connection or the model is cached locally.")
@@ -44,10 +70,17 @@ def initialize_rag_components():
         if os.path.exists(FAISS_INDEX_PATH) and os.path.exists(CONTEXT_DATA_PATH):
             logging.info("Loading FAISS index and context data from disk.")
             try:
-                faiss_index = faiss.read_index(FAISS_INDEX_PATH)
-                with open(CONTEXT_DATA_PATH, 'r') as f:
-                    context_texts = json.load(f)
-                logging.info(f"Loaded {len(context_texts)} context items.")
+                # Memory-map the quantized codes (IO_FLAG_MMAP_IFC, faiss >= 1.11) so they are read from the
+                # page cache on demand instead of being copied onto the heap. IO_FLAG_MMAP alone only maps IVF lists.
+                faiss_index = faiss.read_index(FAISS_INDEX_PATH, faiss.IO_FLAG_MMAP_IFC)
+                # Older index files were brute-force L2; rebuild those as quantized inner-product
+                if faiss_index.metric_type != faiss.METRIC_INNER_PRODUCT:
+                    logging.info(f"{FAISS_INDEX_PATH} is an older L2 index. Rebuilding it as a quantized inner-product index.")
+                    faiss_index = None
+                else:
+                    with open(CONTEXT_DATA_PATH, 'rb') as f:
+                        context_texts = orjson.loads(f.read())
+                    logging.info(f"Loaded {len(context_texts)} context items.")
             except Exception as e:
                 logging.error(f"Failed to load FAISS index or context data: {e}. Rebuilding index.")
                 faiss_index = None # Reset to rebuild
@@ -91,26 +124,49 @@ def initialize_rag_components():
             ]
             context_texts = knowledge_base_documents
             
-            # Encode documents to get embeddings
-            embeddings = embedding_model.encode(knowledge_base_documents)
+            # Encode documents to get unit-length embeddings (inner product on unit vectors == cosine similarity).
+            # encode() sorts by length internally, so batches are padded only to similar lengths.
+            embeddings = embedding_model.encode(
+                knowledge_base_documents,
+                batch_size=32,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+            ).astype(np.float32, copy=False) # FAISS expects float32
             dimension = embeddings.shape[1] # Dimension of the embeddings
 
-            # Create FAISS index (L2 distance is common for semantic similarity)
-            faiss_index = faiss.IndexFlatL2(dimension)
-            faiss_index.add(np.array(embeddings).astype('float32')) # FAISS expects float32
+            # Create FAISS index (8-bit scalar quantized, inner-product metric)
+            faiss_index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+            faiss_index.train(embeddings) # Learns the per-dimension ranges used for quantization
+            faiss_index.add(embeddings)
 
             # Save the index and context data for future use
             faiss.write_index(faiss_index, FAISS_INDEX_PATH)
-            with open(CONTEXT_DATA_PATH, 'w') as f:
-                json.dump(context_texts, f)
+            with open(CONTEXT_DATA_PATH, 'wb') as f:
+                f.write(orjson.dumps(context_texts))
             logging.info(f"Created and saved FAISS index with {len(context_texts)} items.")
 
+# The parent's embedding model, kept referenced in forked workers. Its ONNX Runtime session owns an
+# intra-op thread pool that only exists in the parent, so finalizing it in a child crashes the child.
+_prefork_embedding_model = None
+
+def reinitialize_after_fork():
+    """
+    Recreates the per-process state that cannot be inherited across a fork (gunicorn --preload):
+    ONNX Runtime's thread pool inside the embedding model and Gemini's gRPC clients.
+    The FAISS index and context data stay shared with the parent process.
+    """
+    global embedding_model, _prefork_embedding_model
+    _prefork_embedding_model = embedding_model # Never finalized in this process, see above
+    embedding_model = load_embedding_model()
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+
 # Initialize RAG components when the module is loaded
 # This ensures they are ready before any Flask route tries to use get_sql_from_question
 initialize_rag_components()
 
-# SYSTEM_PROMPT now includes a placeholder for retrieved context
-SYSTEM_PROMPT_TEMPLATE = """
+# SYSTEM_PROMPT is fully static; retrieved context is sent after it per request
+SYSTEM_PROMPT = """
 You are a helpful and precise assistant that converts user questions into valid PostgreSQL SELECT queries.
 
 You are working with a PostgreSQL database called `ecommerce_data` containing these **exact tables and columns**:
@@ -145,8 +201,6 @@ You are working with a PostgreSQL database called `ecommerce_data` containing th
 - Return pure SQL (no ```sql or comments).
 - Do not add LIMIT unless explicitly asked.
 
-{retrieved_context}
-
 Here are some examples:
 Q: What is the total revenue?
 A: SELECT SUM(total_sales) FROM sales_summary;
@@ -157,45 +211,176 @@ A: SELECT * FROM ad_data;
 Q: Show eligibility status of items.
 A: SELECT item_id, eligibility, message FROM eligibility_status;
 
-Now convert the user's question to a valid SQL query.
+Now convert the user's question to a valid SQL query, using the relevant context provided with it.
 """
 
-model = genai.GenerativeModel("models/gemini-1.5-flash")
+# Matches a leading ```/```sql fence or a trailing ``` fence around Gemini's SQL
+_FENCE_RE = re.compile(r"^\s*```(?:sql)?\s*|\s*```\s*$", re.IGNORECASE)
+
+GEMINI_MODEL_NAME = "models/gemini-1.5-flash"
+
+# SQL answers are short: cap output, decode deterministically, and stop at the end of the statement.
+# "```" is deliberately not a stop sequence, since a reply opening with ```sql would stop before any SQL.
+_GEN_CFG = genai.GenerationConfig(
+    max_output_tokens=256,
+    temperature=0.0,
+    candidate_count=1,
+    stop_sequences=[";\n"],
+)
+
+# The static system prompt goes in system_instruction, so it forms the same prefix on every request.
+# It is far below Gemini's minimum size for explicit context caching, so it isn't cached separately.
+model = genai.GenerativeModel(GEMINI_MODEL_NAME, system_instruction=SYSTEM_PROMPT)
+
+# Semantic cache of previously generated SQL, keyed by normalized question embeddings.
+# Row i of sql_cache_index corresponds to sql_cache_queries[i]; the oldest entry is evicted first.
+sql_cache_index = faiss.IndexFlatIP(faiss_index.d)
+sql_cache_queries = deque() # (question literals, SQL) pairs
+sql_cache_lock = threading.Lock()
+
+# Numbers and month names in a question. MiniLM rates questions that differ only in these as
+# near-identical ("sales for item 12" vs "item 13", "June" vs "July"), yet they need different SQL,
+# so a cached answer is only reused when they match exactly.
+_LITERAL_RE = re.compile(
+    r"\d+(?:\.\d+)?"
+    r"|\b(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+    r"|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\b",
+    re.IGNORECASE,
+)
+
+def question_literals(question):
+    """Returns the numbers and month names (as their first three letters) in a question, in order."""
+    return tuple(m[:3] if m[0].isalpha() else m for m in _LITERAL_RE.findall(question.lower()))
+
+def get_cached_sql(query_embedding, literals):
+    """
+    Returns the SQL generated for the most similar past question above
+    SQL_CACHE_SIMILARITY_THRESHOLD whose literals match, or None if there is none.
+    """
+    with sql_cache_lock:
+        if sql_cache_index.ntotal == 0:
+            return None
+        similarities, indices = sql_cache_index.search(query_embedding, k=SQL_CACHE_CANDIDATES)
+        for similarity, idx in zip(similarities[0], indices[0]):
+            if idx < 0 or similarity <= SQL_CACHE_SIMILARITY_THRESHOLD:
+                break
+            cached_literals, cached_sql = sql_cache_queries[idx]
+            if cached_literals == literals:
+                return cached_sql
+    return None
+
+def cache_sql(query_embedding, literals, sql_query):
+    """
+    Adds a question embedding, its literals and its generated SQL to the semantic cache,
+    evicting the oldest entry once SQL_CACHE_MAX_ENTRIES is reached.
+    """
+    with sql_cache_lock:
+        if sql_cache_index.ntotal >= SQL_CACHE_MAX_ENTRIES:
+            # remove_ids shifts the remaining rows down, keeping them aligned with the deque
+            sql_cache_index.remove_ids(np.array([0], dtype='int64'))
+            sql_cache_queries.popleft()
+        sql_cache_index.add(query_embedding)
+        sql_cache_queries.append((literals, sql_query))
+
+RETRIEVAL_TOP_K = 3 # Number of knowledge-base documents retrieved per question
+RETRIEVAL_BATCH_SIZE = 32 # Max questions encoded and searched together
+RETRIEVAL_BATCH_WINDOW = 0.005 # Seconds to wait for more concurrent questions before running a batch
+
+# Concurrent /api/ask requests are coalesced into one encode() + one FAISS search (FAISS only
+# parallelizes across queries within a batch). Each request queues (question, future) and waits.
+_retrieval_queue = queue.Queue()
+_retrieval_worker = None
+_retrieval_worker_lock = threading.Lock()
+
+def _run_retrieval_worker():
+    """
+    Drains up to RETRIEVAL_BATCH_SIZE queued questions (waiting at most RETRIEVAL_BATCH_WINDOW
+    after the first), embeds and searches them as one batch, and resolves each caller's future
+    with its (normalized query embedding, retrieved document indices).
+    """
+    # Only this thread touches these, so they are allocated once and reused for every batch
+    query_buf = np.empty((RETRIEVAL_BATCH_SIZE, faiss_index.d), dtype=np.float32)
+    distances_buf = np.empty((RETRIEVAL_BATCH_SIZE, RETRIEVAL_TOP_K), dtype=np.float32)
+    indices_buf = np.empty((RETRIEVAL_BATCH_SIZE, RETRIEVAL_TOP_K), dtype=np.int64)
+    while True:
+        batch = [_retrieval_queue.get()]
+        deadline = time.monotonic() + RETRIEVAL_BATCH_WINDOW
+        while len(batch) < RETRIEVAL_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(_retrieval_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        n = len(batch)
+        try:
+            queries, distances, indices = query_buf[:n], distances_buf[:n], indices_buf[:n]
+            np.copyto(queries, embedding_model.encode([question for question, _ in batch], convert_to_numpy=True))
+            faiss.normalize_L2(queries) # Index stores normalized vectors
+            faiss_index.search(queries, RETRIEVAL_TOP_K, D=distances, I=indices)
+            for i, (_, future) in enumerate(batch):
+                future.set_result((queries[i:i + 1].copy(), indices[i].copy()))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+
+def retrieve_context(question):
+    """
+    Embeds a question and retrieves its top RETRIEVAL_TOP_K knowledge-base indices via the batching worker.
+    Returns (query_embedding, indices), with query_embedding shaped (1, d) and L2-normalized.
+    """
+    global _retrieval_worker
+    # Started lazily so a worker thread exists in each process (threads don't survive a fork)
+    if _retrieval_worker is None or not _retrieval_worker.is_alive():
+        with _retrieval_worker_lock:
+            if _retrieval_worker is None or not _retrieval_worker.is_alive():
+                _retrieval_worker = threading.Thread(target=_run_retrieval_worker, name="retrieval-batcher", daemon=True)
+                _retrieval_worker.start()
+    future = Future()
+    _retrieval_queue.put((question, future))
+    return future.result()
 
 # ✅ Convert question to SQL with RAG
-def get_sql_from_question(question: str) -> str:
+def get_sql_from_question(question: str):
     """
     Generates a SQL query from a natural language question using RAG.
     Retrieves relevant context from a FAISS index to augment the LLM prompt.
+    Returns (sql_query, cache_entry): cache_entry is the (query_embedding, literals) pair to pass to
+    cache_sql() once the SQL has run successfully, or None if the SQL came from the semantic cache,
+    was cut off at max_output_tokens, or couldn't be generated.
     """
+    # RAG components are initialized at import; bind them to locals once for the hot path
+    local_ctx = context_texts
     try:
-        # Ensure RAG components are initialized (redundant call, but safe)
-        if embedding_model is None or faiss_index is None:
-            initialize_rag_components()
-
-        # Retrieve relevant context using FAISS
-        query_embedding = embedding_model.encode([question]).astype('float32')
-        # Search for top K (e.g., 3) most similar documents
-        distances, indices = faiss_index.search(query_embedding, k=3)
+        # Embed the question and retrieve relevant context using FAISS, batched with concurrent requests
+        query_embedding, indices = retrieve_context(question)
 
-        retrieved_context_str = "\n\nRelevant Context for your question:\n"
-        # Add retrieved documents to the context string
-        for i, idx in enumerate(indices[0]):
-            retrieved_context_str += f"- {context_texts[idx]}\n"
+        # Skip Gemini entirely if a near-identical question was already answered
+        literals = question_literals(question)
+        cached_sql = get_cached_sql(query_embedding, literals)
+        if cached_sql is not None:
+            logging.info(f"Semantic cache hit, reusing SQL: {cached_sql}")
+            return cached_sql, None
 
-        # Augment the system prompt using the template and retrieved context
-        final_system_prompt = SYSTEM_PROMPT_TEMPLATE.format(retrieved_context=retrieved_context_str)
+        # Add retrieved documents to the context string as a bulleted list
+        retrieved_context_str = "\n\nRelevant Context for your question:\n- " + "\n- ".join(local_ctx[idx] for idx in indices)
 
-        # Construct the full prompt for Gemini
-        prompt = f"{final_system_prompt}\n\nUser Question: {question}\nSQL Query:"
+        # Construct the per-request prompt; the static system prompt is sent as the model's system instruction
+        prompt = f"{retrieved_context_str}\n\nUser Question: {question}\nSQL Query:"
         
         logging.info(f"Sending prompt to Gemini:\n{prompt[:500]}...") # Log part of the prompt
 
-        response = model.generate_content(prompt)
-        sql_query = response.text.strip().strip("```sql").strip("```").strip()
+        response = model.generate_content(prompt, generation_config=_GEN_CFG)
+        sql_query = _FENCE_RE.sub("", response.text).strip()
         
         logging.info(f"Received SQL from Gemini: {sql_query}")
-        return sql_query
+        # SQL cut off at the output token cap is likely incomplete; don't offer it for caching
+        if response.candidates[0].finish_reason == genai.protos.Candidate.FinishReason.MAX_TOKENS:
+            logging.warning("Gemini stopped at max_output_tokens; not caching this SQL")
+            return sql_query, None
+        return sql_query, (query_embedding, literals)
     except Exception as e:
         logging.error(f"❌ Error generating SQL with RAG: {str(e)}", exc_info=True) # Log full traceback
-        return f"❌ Error generating SQL: {str(e)}"
\ No newline at end of file
+        return f"❌ Error generating SQL: {str(e)}", None
\ No newline at end of file
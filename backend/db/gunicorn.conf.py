@@ -0,0 +1,19 @@
+# Gunicorn settings for the Flask backend. Run from backend/db with:
+#   gunicorn run:app
+# (gunicorn picks up ./gunicorn.conf.py automatically)
+import multiprocessing
+
+bind = "0.0.0.0:5000"
+workers = min(4, multiprocessing.cpu_count())
+# Threaded (gthread) workers, so concurrent /api/ask requests in one worker reach
+# gemini_utils' retrieval batcher together instead of being served one at a time
+threads = 8
+
+# Import run.py (and gemini_utils' RAG components) once in the master, then fork workers.
+# The FAISS index and context data are shared with the workers copy-on-write. The embedding
+# model and Gemini clients are not fork-safe, so each worker reloads them in post_fork.
+preload_app = True
+
+def post_fork(server, worker):
+    import gemini_utils
+    gemini_utils.reinitialize_after_fork()
@@ -1,25 +1,56 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, literal_column, select, table, text
 from dotenv import load_dotenv
 import os
 import logging
+import datetime
+import hmac
+import time
+from decimal import Decimal
+from functools import lru_cache
 from urllib.parse import quote_plus
+import orjson
+import pandas as pd
 
 # Import the RAG-enabled SQL generation function
-from gemini_utils import get_sql_from_question
+from gemini_utils import cache_sql, get_sql_from_question
 
 logging.basicConfig(level=logging.INFO)
 
 load_dotenv()
 
+def _json_default(obj):
+    # PostgreSQL NUMERIC (e.g. SUM over integer columns) arrives as Decimal, which orjson doesn't encode
+    if isinstance(obj, Decimal):
+        return float(obj)
+    # INTERVAL (e.g. MAX(date) - MIN(date) over timestamps) arrives as timedelta
+    if isinstance(obj, datetime.timedelta):
+        return str(obj)
+    # BYTEA arrives as memoryview
+    if isinstance(obj, (bytes, memoryview)):
+        return bytes(obj).hex()
+    raise TypeError
+
+# ✅ Use orjson for jsonify() responses and request.get_json()
+class OrjsonProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_json_default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
-CORS(app)
+app.json = OrjsonProvider(app)
+# Cross-origin browsers only need the read/ask routes; DELETE /api/data/cache stays same-origin
+CORS(app, methods=["GET", "POST"])
 
 DB_HOST = os.getenv("DB_HOST")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
+CACHE_ADMIN_TOKEN = os.getenv("CACHE_ADMIN_TOKEN") # Required by DELETE /api/data/cache; the route is disabled if unset
 
 # ✅ Encode password
 encoded_password = quote_plus(DB_PASSWORD)
@@ -28,6 +59,52 @@ engine = create_engine(f"postgresql+psycopg2://{DB_USER}:{encoded_password}@{DB_
 
 VALID_TABLES = ["sales_summary", "ad_data", "eligibility_status"]
 
+# ✅ One prebuilt SELECT * per valid table, dispatched by name instead of interpolating it into SQL.
+# Built without reflection so importing the app (e.g. in the gunicorn master) doesn't open a DB connection.
+TABLE_SELECTS = {t: select(literal_column("*")).select_from(table(t)) for t in VALID_TABLES}
+
+# Each worker process has its own cache, so entries also expire on their own after re-running the dataloader
+TABLE_CACHE_TTL = 300 # Seconds
+
+# ✅ Cached, pre-serialized table payloads for /api/data/<table_name>.
+# ttl_bucket changes every TABLE_CACHE_TTL seconds, so a new bucket misses and re-reads the table.
+# maxsize is one payload per table, so stale generations are evicted as new buckets are read.
+@lru_cache(maxsize=len(VALID_TABLES))
+def _table_json(table_name, ttl_bucket):
+    # pandas reads and serializes the whole table in C instead of building a dict per row
+    df = pd.read_sql(TABLE_SELECTS[table_name], engine)
+    # Match /api/ask's orjson output: DATE columns as plain dates (to_json would add a midnight time)
+    # and timestamps to the second
+    for col in df.columns:
+        if pd.api.types.infer_dtype(df[col], skipna=True) == "date":
+            df[col] = pd.to_datetime(df[col]).dt.strftime("%Y-%m-%d")
+    return df.to_json(orient="records", date_format="iso", date_unit="s").encode()
+
+STREAM_BATCH_ROWS = 1000 # Rows fetched from the server-side cursor and encoded per chunk
+
+def _encode_rows(rows):
+    return b','.join(orjson.dumps(dict(row), default=_json_default) for row in rows)
+
+# ✅ Stream an /api/ask payload row batch by row batch; closes the connection when done.
+# The first batch is fetched and encoded by ask() so early failures still get a 500. A failure on a
+# later batch can't change the status any more, so the document is closed with an "error" field instead.
+# The SQL only enters the semantic cache once every row has been read without error.
+def _stream_ask_response(conn, partitions, first_chunk, question, sql_query, cache_entry):
+    try:
+        yield b'{"question":' + orjson.dumps(question) + b',"sql":' + orjson.dumps(sql_query) + b',"result":[' + first_chunk
+        try:
+            for rows in partitions:
+                yield b',' + _encode_rows(rows)
+        except Exception as e:
+            logging.error("❌ Error streaming /api/ask result: %s", e)
+            yield b'],"error":' + orjson.dumps(str(e)) + b'}'
+            return
+        if cache_entry is not None:
+            cache_sql(*cache_entry, sql_query)
+        yield b']}'
+    finally:
+        conn.close()
+
 # ✅ Root route
 @app.route('/')
 def index():
@@ -36,17 +113,25 @@ def index():
 # ✅ Route: Load specific table data (no change needed)
 @app.route('/api/data/<table_name>', methods=['GET'])
 def get_table_data(table_name):
-    if table_name not in VALID_TABLES:
+    if table_name not in TABLE_SELECTS:
         return jsonify({"error": "Invalid table name."}), 400
     try:
-        with engine.connect() as conn:
-            result = conn.execute(text(f"SELECT * FROM {table_name}"))
-            rows = [dict(row._mapping) for row in result]
-        return jsonify(rows)
+        return app.response_class(_table_json(table_name, int(time.monotonic() // TABLE_CACHE_TTL)), mimetype="application/json")
     except Exception as e:
         logging.error("❌ Error fetching table: %s", e)
         return jsonify({"error": str(e)}), 500
 
+# ✅ Route: Drop cached table data (call after re-running the dataloader).
+# Only clears the worker process that serves the request; under gunicorn, send the master
+# a HUP (kill -HUP <pid>) to restart every worker, or wait out TABLE_CACHE_TTL.
+@app.route('/api/data/cache', methods=['DELETE'])
+def clear_table_cache():
+    token = request.headers.get("X-Admin-Token", "")
+    if not CACHE_ADMIN_TOKEN or not hmac.compare_digest(token, CACHE_ADMIN_TOKEN):
+        return jsonify({"error": "Forbidden."}), 403
+    _table_json.cache_clear()
+    return jsonify({"message": "Table data cache cleared."})
+
 @app.route('/api/ask', methods=['POST'])
 def ask():
     try:
@@ -57,24 +142,27 @@ def ask():
             return jsonify({"error": "No question provided."}), 400
 
         # ✅ Get SQL from Gemini (now with RAG internally)
-        sql_query = get_sql_from_question(question)
+        sql_query, cache_entry = get_sql_from_question(question)
         logging.info("🔍 Generated SQL:\n%s", sql_query)
 
         # Handle potential error from get_sql_from_question
         if sql_query.startswith("❌ Error"):
             return jsonify({"error": sql_query}), 500
 
-        # ✅ Run query
-        with engine.connect() as conn:
-            result = conn.execute(text(sql_query))
-            # Convert SQLAlchemy Row objects to dictionaries
-            rows = [dict(row._mapping) for row in result]
-
-        return jsonify({
-            "question": question,
-            "sql": sql_query,
-            "result": rows
-        })
+        # ✅ Run query with a server-side cursor; rows are streamed to the client as they are fetched
+        conn = engine.connect()
+        try:
+            result = conn.execution_options(stream_results=True).execute(text(sql_query))
+            partitions = result.mappings().partitions(STREAM_BATCH_ROWS)
+            first_chunk = _encode_rows(next(partitions, []))
+        except Exception:
+            conn.close()
+            raise
+
+        return Response(
+            stream_with_context(_stream_ask_response(conn, partitions, first_chunk, question, sql_query, cache_entry)),
+            mimetype="application/json"
+        )
 
     except Exception as e:
         logging.error("❌ Error in /api/ask: %s", e)
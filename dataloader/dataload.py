@@ -3,8 +3,13 @@ import pandas as pd
 import os
 from dotenv import load_dotenv
 import urllib.parse
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np # <-- Added import for numpy
 
+logging.basicConfig(level=logging.INFO)
+
 # ✅ Load environment variables
 load_dotenv(dotenv_path='./.env')
 
@@ -27,91 +32,74 @@ file_table_map = {
     "../../datasets/Product-Level Eligibility Table (mapped).csv": "eligibility"
 }
 
+# ✅ Known schema per table: lets pandas' C parser type the columns and parse dates while reading
+DTYPE_MAP = {
+    "total_sales": {"item_id": "string"},
+    "ad_sales": {"item_id": "string"},
+    "eligibility": {"item_id": "string", "eligibility": "string", "message": "string"}
+}
+PARSE_DATES = {
+    "total_sales": ["date"],
+    "ad_sales": ["date"],
+    "eligibility": ["eligibility_datetime_utc"]
+}
+NUMERIC_COLS = {
+    "total_sales": ["total_sales", "total_units_ordered"],
+    "ad_sales": ["ad_sales", "impressions", "ad_spend", "clicks", "units_sold"],
+    "eligibility": []
+}
+ELIGIBILITY_VALUES = {'true': 1, 'false': 0, 'yes': 1, 'no': 0, 'eligible': 1, 'not eligible': 0}
+
+def to_numeric_clean(series):
+    """
+    Converts a column to numeric, stripping currency symbols, commas, spaces and percent signs
+    from columns that were read as text. Unparseable values become NaN.
+    """
+    if not pd.api.types.is_numeric_dtype(series):
+        series = series.astype(str).str.replace(r'[₹$,% ]', '', regex=True)
+    return pd.to_numeric(series, errors='coerce')
+
 # --- NEW: Preprocessing Function ---
 def preprocess_df(df, table_name):
     """
     Performs data cleaning and type conversion based on table name.
     """
-    print(f"⚙️ Preprocessing data for `{table_name}`...")
+    logging.info(f"⚙️ Preprocessing data for `{table_name}`...")
 
     # 1. Standardize column names (already in your original code, kept here for encapsulation)
     df.columns = [col.strip().replace(" ", "_").lower() for col in df.columns]
 
-    # 2. General Data Type Conversions and Cleaning
-    for col in df.columns:
-        # Attempt to convert to numeric, handling common non-numeric characters
-        try:
-            # If column is an object (string) type, try cleaning and converting
-            if df[col].dtype == 'object':
-                # Remove currency symbols, commas, spaces, and handle percentages (e.g., '50%' -> '50')
-                cleaned_series = df[col].astype(str).str.replace(r'[₹$,% ]', '', regex=True)
-                # Convert to numeric, coercing errors to NaN
-                df[col] = pd.to_numeric(cleaned_series, errors='coerce')
-            # If not an object type, a direct to_numeric might still be useful (e.g., converting bools to 0/1)
-            else:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-
-            # After numeric conversion, fill any newly created NaNs (from errors='coerce')
-            if df[col].isnull().any() and pd.api.types.is_numeric_dtype(df[col]):
-                print(f"   - Warning: Column '{col}' in '{table_name}' had non-numeric values converted to NaN. Filling with 0.")
-                df[col] = df[col].fillna(0)
-
-        except Exception:
-            # If numeric conversion fails for any reason, leave column as is (e.g., truly text column)
-            pass
-
-        # Attempt to convert to datetime for columns that might be dates
-        # This runs after numeric conversion, so if a column is purely numeric (like '20230101'),
-        # it might stay numeric unless explicitly handled. For 'YYYY-MM-DD' strings, this is key.
-        if df[col].dtype == 'object': # Only try if it's still an object/string type
-            try:
-                # Infer datetime format for robustness, errors='coerce' turns invalid dates to NaT
-                df[col] = pd.to_datetime(df[col], errors='coerce', infer_datetime_format=True)
-            except Exception:
-                pass # Silently ignore if datetime conversion fails
-
-    # 3. Table-specific preprocessing rules
-    # This is where you can add custom logic for each dataset
-    if table_name == "total_sales":
-        # Ensure 'item_id' is always treated as a string/categorical, even if it looks numeric
-        if 'item_id' in df.columns:
-            df['item_id'] = df['item_id'].astype(str)
-        # Example: If 'date' column exists, ensure it's datetime and handle NaTs
-        if 'date' in df.columns and pd.api.types.is_datetime64_any_dtype(df['date']):
-            # Fill NaT (Not a Time) values if any, e.g., with a default date or by dropping rows
-            df['date'] = df['date'].fillna(pd.Timestamp('1900-01-01')) # Example fill
-        # Add other specific rules for total_sales table
-
-    elif table_name == "ad_sales":
-        # Ensure 'item_id' is always treated as a string/categorical
-        if 'item_id' in df.columns:
-            df['item_id'] = df['item_id'].astype(str)
-        # Example: Handle missing 'ad_spend' or 'ad_sales'
-        if 'ad_spend' in df.columns:
-            df['ad_spend'] = df['ad_spend'].fillna(0)
-        if 'ad_sales' in df.columns:
-            df['ad_sales'] = df['ad_sales'].fillna(0)
-        # Add other specific rules for ad_sales table
-
-    elif table_name == "eligibility":
-        # Ensure 'item_id' is always treated as a string/categorical
-        if 'item_id' in df.columns:
-            df['item_id'] = df['item_id'].astype(str)
-        # Ensure 'eligibility_datetime_utc' is datetime
-        if 'eligibility_datetime_utc' in df.columns:
-             df['eligibility_datetime_utc'] = pd.to_datetime(df['eligibility_datetime_utc'], errors='coerce', infer_datetime_format=True)
-             df['eligibility_datetime_utc'] = df['eligibility_datetime_utc'].fillna(pd.Timestamp('1900-01-01'))
-        # Example: Convert 'eligibility' column (e.g., 'True'/'False' strings) to boolean or int
-        if 'eligibility' in df.columns and df['eligibility'].dtype == 'object':
-            df['eligibility'] = df['eligibility'].astype(str).str.lower().map({'true': 1, 'false': 0, 'yes': 1, 'no': 0, 'eligible': 1, 'not eligible': 0}).fillna(0).astype(int)
-        # Add other specific rules for eligibility table
-
-    # 4. Remove duplicate rows (good general practice after cleaning)
+    # 2. Numeric columns: one vectorized pass, with NaNs (missing or non-numeric values) filled with 0
+    numeric_cols = [col for col in NUMERIC_COLS.get(table_name, []) if col in df.columns]
+    if numeric_cols:
+        df[numeric_cols] = df[numeric_cols].apply(to_numeric_clean).fillna(0)
+
+    # 3. Date columns: normally parsed by read_csv already; coerce any leftovers and fill NaT
+    for col in PARSE_DATES.get(table_name, []):
+        if col in df.columns:
+            if not pd.api.types.is_datetime64_any_dtype(df[col]):
+                df[col] = pd.to_datetime(df[col], errors='coerce')
+            df[col] = df[col].fillna(pd.Timestamp('1900-01-01')) # Example fill
+
+    # 4. Table-specific preprocessing rules
+    # Ensure 'item_id' is always treated as a string/categorical, even if it looks numeric
+    if 'item_id' in df.columns:
+        df['item_id'] = df['item_id'].astype(str)
+
+    if table_name == "eligibility":
+        # Convert 'eligibility' column (e.g., 'True'/'False' strings) to int
+        if 'eligibility' in df.columns:
+            df['eligibility'] = df['eligibility'].astype(str).str.lower().map(ELIGIBILITY_VALUES).fillna(0).astype(int)
+
+    # 5. Remove duplicate rows (good general practice after cleaning)
     df.drop_duplicates(inplace=True)
 
-    print(f"✅ Preprocessing for `{table_name}` complete. DataFrame info after preprocessing:")
-    df.info() # Print info to see dtypes and non-null counts
-    print("-" * 50)
+    logging.info(f"✅ Preprocessing for `{table_name}` complete.")
+    # df.info() walks every column, so only build the dtype/non-null summary when debugging
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        buf = io.StringIO()
+        df.info(buf=buf)
+        logging.debug(f"DataFrame info for `{table_name}` after preprocessing:\n{buf.getvalue()}")
     return df
 
 # ✅ Upload function
@@ -120,21 +108,44 @@ def load_and_upload(csv_path, table_name):
     Loads a CSV, preprocesses it, and uploads it to the specified database table.
     """
     try:
-        print(f"📥 Loading: {csv_path}")
-        df = pd.read_csv(csv_path, encoding='utf-8')
+        logging.info(f"📥 Loading: {csv_path}")
+        df = pd.read_csv(
+            csv_path,
+            encoding='utf-8',
+            dtype=DTYPE_MAP.get(table_name),
+            parse_dates=PARSE_DATES.get(table_name),
+            engine='c'
+        )
 
         # --- Apply preprocessing to the DataFrame ---
         df = preprocess_df(df, table_name)
 
-        # Upload to SQL database
-        df.to_sql(table_name, con=engine, if_exists='replace', index=False)
-        print(f"✅ Uploaded to `{table_name}`\n")
+        # Create (or replace) the table from the DataFrame schema only
+        df.head(0).to_sql(table_name, con=engine, if_exists='replace', index=False)
+
+        # Bulk-load the rows with PostgreSQL COPY instead of row-by-row INSERTs
+        buf = io.StringIO()
+        df.to_csv(buf, index=False, header=False)
+        buf.seek(0)
+        raw = engine.raw_connection()
+        try:
+            with raw.cursor() as cur:
+                cur.copy_expert(f'COPY "{table_name}" FROM STDIN WITH CSV', buf)
+            raw.commit()
+        finally:
+            raw.close()
+        logging.info(f"✅ Uploaded to `{table_name}`")
     except Exception as e:
-        print(f"❌ Error uploading `{table_name}`: {e}\n")
+        logging.error(f"❌ Error uploading `{table_name}`: {e}")
 
-# ✅ Process each file
-for path, table in file_table_map.items():
+def load_if_exists(path, table):
     if os.path.exists(path):
         load_and_upload(path, table)
     else:
-        print(f"❌ File not found: {path}")
+        logging.error(f"❌ File not found: {path}")
+
+# ✅ Process each file concurrently - the tables are independent.
+# pandas parsing and COPY release the GIL; each upload checks out its own connection from the engine's pool.
+with ThreadPoolExecutor(max_workers=len(file_table_map)) as executor:
+    list(executor.map(load_if_exists, file_table_map.keys(), file_table_map.values()))
+
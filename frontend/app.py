@@ -1,9 +1,69 @@
 import streamlit as st
 import requests
+import orjson
+import hashlib
 import pandas as pd
+import numpy as np
 import plotly.express as px
-import matplotlib.pyplot as plt
-import io # For capturing matplotlib figures
+import sys
+import re
+
+# Above this many rows, line/scatter traces are LTTB-downsampled server-side before reaching the browser
+RESAMPLE_THRESHOLD_ROWS = 2000
+# Above this many rows, line/scatter traces are drawn with WebGL (scattergl) instead of SVG
+WEBGL_THRESHOLD_ROWS = 1000
+# Max rows sent to the browser's data grid per render; larger results get a start-row slider
+TABLE_PAGE_ROWS = 5000
+# Matplotlib bar charts show at most this many (largest) categories
+MATPLOTLIB_BAR_MAX_CATEGORIES = 50
+# Results are truncated to this many rows as they arrive from the backend
+MAX_RESULT_ROWS = 50000
+# Line/scatter charts that aren't resampled plot a random (order-preserving) subset of this many rows
+CHART_SAMPLE_ROWS = 5000
+
+# --- BACKEND ---
+API_URL = "http://127.0.0.1:5000/api/ask" # Ensure your backend Flask app is running here
+
+@st.cache_resource
+def get_http_session():
+    """One pooled HTTP session shared across reruns, so backend calls reuse TCP connections."""
+    return requests.Session()
+
+class BackendError(Exception):
+    """An error payload returned by the backend; raised so st.cache_data doesn't cache it."""
+
+def post_question(question: str):
+    """
+    Sends a question to the backend. Returns (data, data_key), where data_key is a hash of
+    the raw response body used to cache work derived from it. Results over MAX_RESULT_ROWS
+    are cut here, so cached answers never hold more rows than are shown; data['truncated'] flags it.
+    """
+    response = get_http_session().post(API_URL, json={"question": question}, timeout=60)
+    data = orjson.loads(response.content)
+    result = data.get("result")
+    if isinstance(result, list) and len(result) > MAX_RESULT_ROWS:
+        data["result"] = result[:MAX_RESULT_ROWS]
+        data["truncated"] = True
+    return data, hashlib.sha1(response.content).hexdigest()
+
+@st.cache_data(ttl=600, max_entries=32, show_spinner=False)
+def _ask_backend_cached(question: str):
+    data, data_key = post_question(question)
+    if 'error' in data:
+        raise BackendError(data['error'])
+    return data, data_key
+
+def ask_backend(question: str, bypass_cache: bool = False):
+    """
+    Like post_question, but successful answers are cached per question for 10 minutes,
+    so repeated questions skip the backend and Gemini entirely.
+    """
+    if bypass_cache:
+        return post_question(question)
+    try:
+        return _ask_backend_cached(question)
+    except BackendError as e:
+        return {"error": str(e)}, None
 
 # --- PAGE SETTINGS ---
 st.set_page_config(page_title="🤖 E-commerce Assistant Bot", layout="wide", initial_sidebar_state="expanded")
@@ -92,7 +152,183 @@ if "chat_history" not in st.session_state:
 if "current_question_input" not in st.session_state:
     st.session_state.current_question_input = ""
 
-API_URL = "http://127.0.0.1:5000/api/ask" # Ensure your backend Flask app is running here
+def load_pyplot():
+    """
+    Imports matplotlib.pyplot on first use only, with the non-interactive Agg backend
+    (no Tk/Qt initialization). Keeps matplotlib off the start-up path when Plotly is used.
+    """
+    if 'matplotlib.pyplot' not in sys.modules:
+        import matplotlib
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+def load_figure_resampler():
+    """
+    Imports plotly-resampler's FigureResampler on first use only. It pulls in Dash, which
+    small results that are never resampled don't need at start-up.
+    """
+    from plotly_resampler import FigureResampler
+    return FigureResampler
+
+# --- RESULT PROCESSING ---
+# Currency symbols, thousands separators, spaces and percent signs stripped before numeric parsing
+_NUMERIC_JUNK = str.maketrans('', '', '₹$,% ')
+
+_ISO_DATE_RE = re.compile(r'\d{4}-\d{2}-\d{2}')
+_ISO_DATETIME_RE = re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?')
+
+def guess_datetime_format(series):
+    """
+    Cheap pre-check before attempting pd.to_datetime on a text column, based on its first non-null value.
+    Returns (looks_like_datetime, format): format is an explicit fast-path format for ISO-style values
+    (e.g. 2025-06-01, 2025-06-04T08:50:07), or None to let pandas infer it.
+    """
+    first_valid = series.first_valid_index()
+    if first_valid is None:
+        return False, None
+    sample = series[first_valid]
+    if not (isinstance(sample, str) and 8 <= len(sample) <= 32 and sample[:1].isdigit()):
+        return False, None
+    if _ISO_DATE_RE.fullmatch(sample):
+        return True, '%Y-%m-%d'
+    if _ISO_DATETIME_RE.fullmatch(sample):
+        return True, 'ISO8601'
+    return True, None
+
+def coerce_column(series):
+    """
+    Converts a text (object) column to numeric if all its values parse as numbers (after stripping
+    currency symbols, commas, spaces and percent signs), else to datetime if they all parse as
+    dates, else returns it unchanged.
+    """
+    non_null = series.notna().sum()
+    numeric = pd.to_numeric(series.astype(str).str.translate(_NUMERIC_JUNK), errors='coerce')
+    if numeric.notna().sum() >= non_null:
+        return numeric
+    looks_like_datetime, datetime_format = guess_datetime_format(series)
+    if looks_like_datetime:
+        datetimes = pd.to_datetime(series, format=datetime_format, errors='coerce')
+        if datetimes.notna().sum() >= non_null:
+            return datetimes
+    return series
+
+@st.cache_data(ttl=600, max_entries=32, show_spinner=False)
+def build_df(data_key, _result):
+    """
+    Builds the result DataFrame with visualization-friendly dtypes, plus its non-empty
+    numeric, categorical and datetime column lists. Cached per response (data_key), so
+    widget-triggered reruns don't redo the type conversion. The cache is shared by all
+    sessions, so it is bounded and expires with the answer cache.
+    """
+    df = pd.DataFrame(_result)
+
+    # --- IMPORTANT: Data Type Conversion for Robust Visualization ---
+    # Define columns that should *always* be treated as categorical, even if they look numeric
+    # Add any other ID columns (like customer_id, product_category_id if they are categories)
+    known_categorical_id_cols = {'item_id'}
+
+    # Convert the text columns up front and assemble the frame once, rather than reassigning column by column.
+    # Columns the backend already sent as numbers/booleans are kept as they are.
+    # Known ID columns become Arrow-backed strings directly, so they are definitively treated as categorical
+    # (Arrow strings also take less memory than object columns and serialize faster into Plotly JSON).
+    obj_cols = set(df.select_dtypes(include='object').columns)
+    df = pd.concat([
+        df[col].astype('string[pyarrow]') if col in known_categorical_id_cols
+        else coerce_column(df[col]) if col in obj_cols
+        else df[col]
+        for col in df.columns
+    ], axis=1, keys=df.columns)
+
+    # Re-identify columns after all potential type conversions, leaving out columns that are all NaN.
+    # The all-NaN check is one vectorized pass over the frame, shared by the three dtype groups.
+    all_null = df.isna().all()
+    numeric_cols = [col for col in df.select_dtypes(include=['number']).columns if not all_null[col]]
+    category_cols = [col for col in df.select_dtypes(include=['object', 'string', 'category']).columns if not all_null[col]] # Ensure 'string'/'category' dtypes are included
+    datetime_cols = [col for col in df.select_dtypes(include=['datetime']).columns if not all_null[col]]
+
+    return df, numeric_cols, category_cols, datetime_cols
+
+def sample_rows(df, n=CHART_SAMPLE_ROWS):
+    """Returns at most n rows of df, chosen uniformly at random (seeded) and kept in their original order."""
+    if len(df) <= n:
+        return df
+    return df.iloc[np.sort(np.random.default_rng(0).choice(len(df), size=n, replace=False))]
+
+@st.cache_data(ttl=600, max_entries=8, show_spinner=False)
+def sort_by_x(data_key, x_axis, _df):
+    """
+    The result frame sorted by the x-axis column, cached per (response, x-axis) so line charts and
+    resampled scatter plots don't re-sort on every click. Mergesort is stable and fast on the
+    already-nearly-sorted time series typical here. Each entry is a full copy of the frame, so only
+    the most recent few are kept.
+    """
+    return _df.sort_values(by=x_axis, kind='mergesort')
+
+@st.cache_data(ttl=600, max_entries=16, show_spinner=False)
+def make_plotly_fig(data_key, chart_type, x_axis, y_axis, x_is_categorical, x_is_datetime, x_is_numeric, y_is_numeric, _df):
+    """
+    Builds the Plotly figure for the chosen chart. Cached per (response, chart options), so reruns
+    from unrelated widgets, or re-clicking Generate Chart, reuse the figure instead of rebuilding it.
+    Figures can hold every result row, so only the most recent few are kept.
+    Returns (fig, error): fig is None when the options don't fit the chart type, and error explains why.
+    """
+    df = _df
+    fig, error = None, None
+    plotly_common_args = {"title": f"{y_axis} by {x_axis}" if x_axis != "--- Select X-axis ---" else f"Distribution of {y_axis}"}
+    render_mode = "webgl" if len(df) > WEBGL_THRESHOLD_ROWS else "svg"
+
+    if chart_type == "Bar Chart":
+        fig = px.bar(df, x=x_axis, y=y_axis, **plotly_common_args, text_auto=True)
+    elif chart_type == "Line Chart":
+        # Sort by X for line plots, especially if X is numeric but represents categories
+        plot_df = sort_by_x(data_key, x_axis, df)
+        if len(df) > RESAMPLE_THRESHOLD_ROWS and (x_is_numeric or x_is_datetime):
+            FigureResampler = load_figure_resampler()
+            fig = FigureResampler(px.line(plot_df, x=x_axis, y=y_axis, **plotly_common_args, markers=True, render_mode=render_mode),
+                                  default_n_shown_samples=RESAMPLE_THRESHOLD_ROWS)
+        else:
+            fig = px.line(sample_rows(plot_df), x=x_axis, y=y_axis, **plotly_common_args, markers=True, render_mode=render_mode)
+    elif chart_type == "Pie Chart":
+        if x_is_categorical and y_is_numeric:
+            fig = px.pie(df, names=x_axis, values=y_axis, title=f"{y_axis} Distribution by {x_axis}")
+        else: error = "Pie chart needs categorical X-axis and numeric Y-axis."
+    elif chart_type == "Scatter Plot":
+        if x_is_numeric and y_is_numeric:
+            if len(df) > RESAMPLE_THRESHOLD_ROWS:
+                # The resampler expects sorted x values, passed as NumPy arrays
+                plot_df = sort_by_x(data_key, x_axis, df)
+                FigureResampler = load_figure_resampler()
+                fig = FigureResampler(
+                    px.scatter(x=plot_df[x_axis].to_numpy(), y=plot_df[y_axis].to_numpy(),
+                               labels={"x": x_axis, "y": y_axis}, **plotly_common_args, render_mode=render_mode),
+                    default_n_shown_samples=RESAMPLE_THRESHOLD_ROWS
+                )
+            else:
+                # A few extra columns in the hover label; every column would be serialized for every point
+                hover_cols = [col for col in df.columns if col not in (x_axis, y_axis)][:3]
+                fig = px.scatter(df, x=x_axis, y=y_axis, **plotly_common_args, hover_data=hover_cols, render_mode=render_mode)
+        else: error = "Scatter plot needs two numeric axes (X and Y)."
+    elif chart_type == "Treemap":
+        if x_is_categorical and y_is_numeric:
+            fig = px.treemap(df, path=[x_axis], values=y_axis, title=f"{y_axis} by {x_axis} Treemap")
+        else: error = "Treemap needs categorical X-axis (path) and numeric Y-axis (values)."
+    elif chart_type == "Box Plot":
+        fig = px.box(df, x=x_axis if x_axis != "--- Select X-axis ---" else None, y=y_axis,
+                     title=f"{y_axis} Distribution {'by ' + x_axis if x_axis != '--- Select X-axis ---' else ''}")
+    elif chart_type == "Histogram":
+        fig = px.histogram(df, x=y_axis, title=f"Distribution of {y_axis}", marginal="box", nbins=20)
+
+    return fig, error
+
+@st.cache_data(ttl=600, max_entries=32, show_spinner=False)
+def aggregate_for_bar(data_key, x_axis, y_axis, _df):
+    """
+    Sums y per x category, largest first, keeping the top MATPLOTLIB_BAR_MAX_CATEGORIES.
+    Cached per (response, axes) so the groupby doesn't re-scan the frame on every click.
+    """
+    return _df.groupby(x_axis)[y_axis].sum().sort_values(ascending=False).head(MATPLOTLIB_BAR_MAX_CATEGORIES)
+
 st.markdown("---")
 
 # --- INPUT ---
@@ -103,6 +339,8 @@ question = st.text_input(
     value=st.session_state.current_question_input
 )
 
+bypass_cache = st.checkbox("🔄 Bypass cache", key="bypass_cache", help="Ask the backend again even if this question was answered in the last 10 minutes.")
+
 col_ask_button, col_clear_button = st.columns([0.2, 0.8])
 with col_ask_button:
     if st.button("🚀 Ask Bot", key="ask_button"):
@@ -111,8 +349,7 @@ with col_ask_button:
         else:
             with st.spinner("🤖 Bot is thinking..."):
                 try:
-                    response = requests.post(API_URL, json={"question": question})
-                    data = response.json()
+                    data, data_key = ask_backend(question, bypass_cache=bypass_cache)
 
                     if 'error' in data:
                         st.error("❌ " + data['error'])
@@ -120,6 +357,8 @@ with col_ask_button:
                         st.success("✅ Bot answered your question!") # Keep this general success message
                         result = data.get("result", None)
                         sql = data.get("sql", "No SQL generated.")
+                        if data.get("truncated"):
+                            st.warning(f"⚠️ Showing the first {MAX_RESULT_ROWS:,} rows; narrow your query for full results.")
 
                         # Smart answer formatting (modified to remove the specific "data table" message)
                         answer_text = "⚠️ No meaningful result returned."
@@ -146,7 +385,8 @@ with col_ask_button:
                             "question": question,
                             "answer": answer_text,
                             "sql": sql,
-                            "data": result
+                            "data": result,
+                            "data_key": data_key # Cache key for build_df
                         })
                         st.session_state.current_question_input = ""
 
@@ -161,16 +401,22 @@ with col_clear_button:
         st.success("Chat history cleared!")
 
 # --- CHAT HISTORY ---
-st.sidebar.markdown("### 📜 Chat History")
-if st.session_state.chat_history:
-    for i, chat in enumerate(reversed(st.session_state.chat_history), 1):
-        with st.sidebar.expander(f"Q{len(st.session_state.chat_history) - i + 1}: {chat['question'][:40]}...", expanded=False):
-            st.markdown(f"**Question:** {chat['question']}")
-            st.markdown(f"**Answer:** {chat['answer']}")
-            if st.checkbox(f"🔍 Show SQL", key=f"sql_sidebar_{len(st.session_state.chat_history) - i + 1}"):
-                st.code(chat["sql"], language="sql")
-else:
-    st.sidebar.info("No chat history yet. Ask a question to start!")
+# A fragment: toggling "Show SQL" reruns only the history, not the whole page
+@st.fragment
+def render_history():
+    st.markdown("### 📜 Chat History")
+    if st.session_state.chat_history:
+        for i, chat in enumerate(reversed(st.session_state.chat_history), 1):
+            with st.expander(f"Q{len(st.session_state.chat_history) - i + 1}: {chat['question'][:40]}...", expanded=False):
+                st.markdown(f"**Question:** {chat['question']}")
+                st.markdown(f"**Answer:** {chat['answer']}")
+                if st.checkbox(f"🔍 Show SQL", key=f"sql_sidebar_{len(st.session_state.chat_history) - i + 1}"):
+                    st.code(chat["sql"], language="sql")
+    else:
+        st.info("No chat history yet. Ask a question to start!")
+
+with st.sidebar:
+    render_history()
 
 st.markdown("---")
 
@@ -188,52 +434,7 @@ if st.session_state.chat_history:
 
     # --- VISUALIZATION & TABLE ---
     if isinstance(result, list) and result:
-        df = pd.DataFrame(result)
-
-        # --- IMPORTANT: Data Type Conversion for Robust Visualization ---
-        # Define columns that should *always* be treated as categorical, even if they look numeric
-        # Add any other ID columns (like customer_id, product_category_id if they are categories)
-        known_categorical_id_cols = ['item_id']
-
-        for col in df.columns:
-            # First, attempt to convert to numeric for all columns
-            # This covers sales, spend, etc., and also *numeric-like* IDs before we force them to string
-            try:
-                # Clean potential non-numeric characters if it's an object type (string)
-                if df[col].dtype == 'object':
-                    cleaned_col = df[col].astype(str).str.replace(r'[₹$,% ]', '', regex=True)
-                    df[col] = pd.to_numeric(cleaned_col, errors='coerce')
-                # If not an object type, still try to convert to numeric (e.g., bools)
-                else:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-            except Exception:
-                pass # Silently ignore if numeric conversion fails
-
-            # Then, attempt datetime conversion for 'object' types that remain after numeric attempts
-            # This is important if a column is like 'YYYY-MM-DD'
-            if df[col].dtype == 'object':
-                try:
-                    df[col] = pd.to_datetime(df[col], errors='coerce', infer_datetime_format=True)
-                except Exception:
-                    pass # Silently ignore if datetime conversion fails
-        
-        # --- NEW: Explicitly convert known ID columns to string AFTER all other conversions ---
-        # This ensures they are definitively treated as categorical and not re-converted to numeric.
-        for col in known_categorical_id_cols:
-            if col in df.columns and pd.api.types.is_numeric_dtype(df[col]):
-                # Only convert if it's currently numeric, meaning it passed the numeric check
-                df[col] = df[col].astype(str)
-
-
-        # Re-identify columns after all potential type conversions
-        numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-        category_cols = df.select_dtypes(include=['object', 'category']).columns.tolist() # Ensure 'category' dtype is included
-        datetime_cols = df.select_dtypes(include=['datetime']).columns.tolist()
-
-        # Filter out columns that are all NaN after conversion
-        numeric_cols = [col for col in numeric_cols if not df[col].isnull().all()]
-        category_cols = [col for col in category_cols if not df[col].isnull().all()]
-        datetime_cols = [col for col in datetime_cols if not df[col].isnull().all()]
+        df, numeric_cols, category_cols, datetime_cols = build_df(latest["data_key"], result)
 
         if not df.empty:
             st.markdown("---")
@@ -277,10 +478,12 @@ if st.session_state.chat_history:
 
                     chart_type_options = ["--- Select Chart Type ---"]
 
-                    x_is_categorical = x_axis in category_cols
-                    x_is_datetime = x_axis in datetime_cols
-                    x_is_numeric = x_axis in numeric_cols
-                    y_is_numeric = y_axis in numeric_cols
+                    # Axis kinds come straight from the column dtypes (the placeholder options aren't columns)
+                    x_dtype = df[x_axis].dtype if x_axis in df.columns else None
+                    x_is_categorical = x_dtype is not None and (pd.api.types.is_object_dtype(x_dtype) or isinstance(x_dtype, (pd.StringDtype, pd.CategoricalDtype)))
+                    x_is_datetime = x_dtype is not None and pd.api.types.is_datetime64_any_dtype(x_dtype)
+                    x_is_numeric = x_dtype is not None and pd.api.types.is_numeric_dtype(x_dtype) and not pd.api.types.is_bool_dtype(x_dtype)
+                    y_is_numeric = y_axis in df.columns and pd.api.types.is_numeric_dtype(df[y_axis]) and not pd.api.types.is_bool_dtype(df[y_axis])
 
                     if y_is_numeric:
                         if x_is_categorical or x_is_datetime:
@@ -313,32 +516,11 @@ if st.session_state.chat_history:
                         else:
                             fig = None
                             try:
-                                plotly_common_args = {"title": f"{y_axis} by {x_axis}" if x_axis != "--- Select X-axis ---" else f"Distribution of {y_axis}"}
-
                                 if viz_lib == "Plotly":
-                                    if chart_type == "Bar Chart":
-                                        fig = px.bar(df, x=x_axis, y=y_axis, **plotly_common_args, text_auto=True)
-                                    elif chart_type == "Line Chart":
-                                        # Sort by X for line plots, especially if X is numeric but represents categories
-                                        plot_df = df.sort_values(by=x_axis)
-                                        fig = px.line(plot_df, x=x_axis, y=y_axis, **plotly_common_args, markers=True)
-                                    elif chart_type == "Pie Chart":
-                                        if x_is_categorical and y_is_numeric:
-                                            fig = px.pie(df, names=x_axis, values=y_axis, title=f"{y_axis} Distribution by {x_axis}")
-                                        else: st.error("Pie chart needs categorical X-axis and numeric Y-axis.")
-                                    elif chart_type == "Scatter Plot":
-                                        if x_is_numeric and y_is_numeric:
-                                            fig = px.scatter(df, x=x_axis, y=y_axis, **plotly_common_args, hover_data=df.columns)
-                                        else: st.error("Scatter plot needs two numeric axes (X and Y).")
-                                    elif chart_type == "Treemap":
-                                        if x_is_categorical and y_is_numeric:
-                                            fig = px.treemap(df, path=[x_axis], values=y_axis, title=f"{y_axis} by {x_axis} Treemap")
-                                        else: st.error("Treemap needs categorical X-axis (path) and numeric Y-axis (values).")
-                                    elif chart_type == "Box Plot":
-                                        fig = px.box(df, x=x_axis if x_axis != "--- Select X-axis ---" else None, y=y_axis,
-                                                     title=f"{y_axis} Distribution {'by ' + x_axis if x_axis != '--- Select X-axis ---' else ''}")
-                                    elif chart_type == "Histogram":
-                                        fig = px.histogram(df, x=y_axis, title=f"Distribution of {y_axis}", marginal="box", nbins=20)
+                                    fig, plotly_error = make_plotly_fig(latest["data_key"], chart_type, x_axis, y_axis,
+                                                                        x_is_categorical, x_is_datetime, x_is_numeric, y_is_numeric, df)
+                                    if plotly_error:
+                                        st.error(plotly_error)
 
                                     if fig:
                                         st.plotly_chart(fig, use_container_width=True)
@@ -346,60 +528,67 @@ if st.session_state.chat_history:
                                         st.error("❌ Plotly chart could not be generated with the selected options. Please ensure axis types match chart requirements.")
 
                                 elif viz_lib == "Matplotlib":
-                                    fig, ax = plt.subplots(figsize=(10, 6))
-                                    if chart_type == "Bar Chart":
-                                        if x_is_categorical and y_is_numeric:
-                                            df_plot = df.groupby(x_axis)[y_axis].sum().sort_values(ascending=False) # Sort for better bar charts
-                                            df_plot.plot(kind="bar", ax=ax, color='skyblue')
-                                            ax.set_title(f"{y_axis} by {x_axis}")
-                                            ax.set_ylabel(y_axis)
-                                            ax.set_xlabel(x_axis)
-                                            plt.xticks(rotation=45, ha='right')
-                                        else: st.error("Matplotlib Bar Chart needs categorical X and numeric Y.")
-                                    elif chart_type == "Line Chart":
-                                        if (x_is_categorical or x_is_datetime or x_is_numeric) and y_is_numeric:
-                                            plot_df = df.sort_values(by=x_axis) # Sort for sensible line plot
-                                            plot_df.plot(kind="line", x=x_axis, y=y_axis, ax=ax, marker='o')
-                                            ax.set_title(f"{y_axis} over {x_axis}")
-                                            ax.set_ylabel(y_axis)
-                                            ax.set_xlabel(x_axis)
-                                            plt.xticks(rotation=45, ha='right')
-                                        else: st.error("Matplotlib Line Chart needs numeric Y and (categorical, datetime, or numeric) X.")
-                                    elif chart_type == "Box Plot":
-                                        if y_is_numeric:
-                                            if x_is_categorical:
-                                                df.boxplot(column=y_axis, by=x_axis, ax=ax)
-                                                ax.set_title(f"{y_axis} Distribution by {x_axis}")
-                                                plt.suptitle('')
+                                    plt = load_pyplot()
+                                    # Widen the figure with the number of categories; dpi 80 keeps the rasterized PNG small
+                                    n_cats = min(df[x_axis].nunique(), MATPLOTLIB_BAR_MAX_CATEGORIES) if x_is_categorical else 0
+                                    fig, ax = plt.subplots(figsize=(min(20, max(6, 0.3 * n_cats)), 6), dpi=80)
+                                    try:
+                                        if chart_type == "Bar Chart":
+                                            if x_is_categorical and y_is_numeric:
+                                                df_plot = aggregate_for_bar(latest["data_key"], x_axis, y_axis, df) # Sorted for better bar charts
+                                                df_plot.plot(kind="bar", ax=ax, color='skyblue')
+                                                ax.set_title(f"{y_axis} by {x_axis}")
                                                 ax.set_ylabel(y_axis)
                                                 ax.set_xlabel(x_axis)
-                                            else:
-                                                df[y_axis].plot(kind="box", ax=ax)
-                                                ax.set_title(f"Box Plot of {y_axis}")
+                                                plt.xticks(rotation=45, ha='right')
+                                            else: st.error("Matplotlib Bar Chart needs categorical X and numeric Y.")
+                                        elif chart_type == "Line Chart":
+                                            if (x_is_categorical or x_is_datetime or x_is_numeric) and y_is_numeric:
+                                                plot_df = sample_rows(sort_by_x(latest["data_key"], x_axis, df)) # Sort for sensible line plot
+                                                plot_df.plot(kind="line", x=x_axis, y=y_axis, ax=ax, marker='o')
+                                                ax.set_title(f"{y_axis} over {x_axis}")
                                                 ax.set_ylabel(y_axis)
-                                        else: st.error("Matplotlib Box Plot needs a numeric Y-axis.")
-                                    elif chart_type == "Scatter Plot":
-                                        if x_is_numeric and y_is_numeric:
-                                            ax.scatter(df[x_axis], df[y_axis], alpha=0.7)
-                                            ax.set_xlabel(x_axis)
-                                            ax.set_ylabel(y_axis)
-                                            ax.set_title(f"{y_axis} vs {x_axis}")
-                                        else: st.error("Matplotlib Scatter Plot needs two numeric axes (X and Y).")
-                                    elif chart_type == "Histogram":
-                                        if y_is_numeric:
-                                            ax.hist(df[y_axis], bins=20, edgecolor='black', alpha=0.7)
-                                            ax.set_xlabel(y_axis)
-                                            ax.set_ylabel("Frequency")
-                                            ax.set_title(f"Distribution of {y_axis}")
-                                        else: st.error("Matplotlib Histogram needs a numeric Y-axis.")
-                                    elif chart_type == "Treemap" or chart_type == "Pie Chart":
-                                        st.error("⚠️ Matplotlib does not have built-in Treemap or Pie chart functions that align well with Streamlit's dynamic axis selection. Please use **Plotly** for these chart types.")
-                                    else:
-                                        st.warning("⚠️ Matplotlib can't create this chart type with the selected axes or it's not implemented yet. Try Plotly.")
-
-                                    if fig:
-                                        st.pyplot(fig)
-                                    plt.close(fig)
+                                                ax.set_xlabel(x_axis)
+                                                plt.xticks(rotation=45, ha='right')
+                                            else: st.error("Matplotlib Line Chart needs numeric Y and (categorical, datetime, or numeric) X.")
+                                        elif chart_type == "Box Plot":
+                                            if y_is_numeric:
+                                                if x_is_categorical:
+                                                    df.boxplot(column=y_axis, by=x_axis, ax=ax)
+                                                    ax.set_title(f"{y_axis} Distribution by {x_axis}")
+                                                    plt.suptitle('')
+                                                    ax.set_ylabel(y_axis)
+                                                    ax.set_xlabel(x_axis)
+                                                else:
+                                                    df[y_axis].plot(kind="box", ax=ax)
+                                                    ax.set_title(f"Box Plot of {y_axis}")
+                                                    ax.set_ylabel(y_axis)
+                                            else: st.error("Matplotlib Box Plot needs a numeric Y-axis.")
+                                        elif chart_type == "Scatter Plot":
+                                            if x_is_numeric and y_is_numeric:
+                                                scatter_df = sample_rows(df)
+                                                ax.scatter(scatter_df[x_axis], scatter_df[y_axis], alpha=0.7)
+                                                ax.set_xlabel(x_axis)
+                                                ax.set_ylabel(y_axis)
+                                                ax.set_title(f"{y_axis} vs {x_axis}")
+                                            else: st.error("Matplotlib Scatter Plot needs two numeric axes (X and Y).")
+                                        elif chart_type == "Histogram":
+                                            if y_is_numeric:
+                                                ax.hist(df[y_axis], bins=20, edgecolor='black', alpha=0.7)
+                                                ax.set_xlabel(y_axis)
+                                                ax.set_ylabel("Frequency")
+                                                ax.set_title(f"Distribution of {y_axis}")
+                                            else: st.error("Matplotlib Histogram needs a numeric Y-axis.")
+                                        elif chart_type == "Treemap" or chart_type == "Pie Chart":
+                                            st.error("⚠️ Matplotlib does not have built-in Treemap or Pie chart functions that align well with Streamlit's dynamic axis selection. Please use **Plotly** for these chart types.")
+                                        else:
+                                            st.warning("⚠️ Matplotlib can't create this chart type with the selected axes or it's not implemented yet. Try Plotly.")
+
+                                        if fig:
+                                            st.pyplot(fig)
+                                    finally:
+                                        # Close even if plotting fails, so figures don't pile up in the Streamlit process
+                                        plt.close(fig)
 
                             except Exception as e:
                                 st.error(f"❌ Visualization failed: {e}. Please ensure selected columns are appropriate for the chart type and library.")
@@ -407,7 +596,14 @@ if st.session_state.chat_history:
 
             with tab2:
                 st.markdown("#### Raw Data Table")
-                st.dataframe(df, use_container_width=True)
+                n_rows = len(df)
+                if n_rows > TABLE_PAGE_ROWS:
+                    # Only a window of rows is rendered; charts still use the full df
+                    start = st.slider("Start row", 0, n_rows - TABLE_PAGE_ROWS, 0, key="raw_table_start")
+                    st.caption(f"Showing rows {start:,}–{start + TABLE_PAGE_ROWS - 1:,} of {n_rows:,}")
+                    st.dataframe(df.iloc[start:start + TABLE_PAGE_ROWS], use_container_width=True)
+                else:
+                    st.dataframe(df, use_container_width=True)
                 st.markdown("---")
                 st.markdown("##### Data Types after Conversion:")
                 st.dataframe(pd.DataFrame(df.dtypes, columns=['Dtype']), use_container_width=True)